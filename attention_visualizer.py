@@ -12,12 +12,29 @@ Usage (in Jupyter):
     input_bounds = np.random.rand(4, 150)
 
     show_attention_graph(reaction_ids, reaction_names, attention_tensors, input_bounds)
+
+    # Keep a handle to redraw the same output in place, e.g. with another run's tensors
+    handle = show_attention_graph(reaction_ids, reaction_names, attention_tensors, input_bounds,
+                                  return_handle=True)
+    show_attention_graph(reaction_ids, reaction_names, other_tensors, input_bounds,
+                         display_handle=handle)
 """
 
+import base64
+import io
 import json
+import os
 import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from html import escape
 import numpy as np
-from IPython.display import display, HTML
+from IPython.display import display
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 _PALETTE = [
     ('#2a9d8f', '#1d7068', '#3fc0b0'),
@@ -34,27 +51,206 @@ _PALETTE = [
     ('#a0855b', '#7a6340', '#c0a57b'),
 ]
 
+# Max threshold lines drawn per layer
+_MAX_TL = 600
+
+# Head and threshold sliders above one layer's connection column
+_LAYER_SLIDER_TMPL = """
+        <div style="position:absolute; left:{left:.0f}px; top:6px; width:{width}px;
+                     font-size:10px; color:#555; background:#f5f5f5; border:1px solid #ddd;
+                     border-radius:4px; padding:3px 6px; box-sizing:border-box;">
+          <div style="font-weight:bold; text-align:center; margin-bottom:2px; color:#333;">Layer {l}</div>
+          <div style="display:flex; align-items:center; gap:2px;">
+            <span style="min-width:14px;">H:</span>
+            <input id="{uid}-head-{l}" type="range" min="0" max="{hmax}" value="0"
+                   style="flex:1; height:12px; cursor:pointer;" data-layer="{l}">
+            <span id="{uid}-hval-{l}" style="min-width:18px; text-align:right;">0</span>
+          </div>
+          <div style="display:flex; align-items:center; gap:2px;">
+            <span style="min-width:14px;">T:</span>
+            <input id="{uid}-thresh-{l}" type="range" min="0" max="1000" value="950"
+                   style="flex:1; height:12px; cursor:pointer;" data-layer="{l}">
+            <span id="{uid}-tval-{l}" style="min-width:50px; text-align:right; font-size:9px;"></span>
+          </div>
+        </div>
+        """
+
+
+def _b64(a, dtype=np.float32):
+    """Base64-encode an array as a flat little-endian buffer of `dtype`."""
+    return base64.b64encode(np.ascontiguousarray(a, dtype=dtype).tobytes()).decode('ascii')
+
+
+def _write_json(obj, buf):
+    """Serialize `obj` straight into the text stream `buf` (orjson if installed)."""
+    if orjson is not None:
+        buf.write(orjson.dumps(obj).decode('utf-8'))
+    else:
+        json.dump(obj, buf, separators=(',', ':'))
+
+
+def _search_index(strings):
+    """
+    Lowercased `strings` joined by NUL, plus the N+1 start offsets of each
+    entry in UTF-16 code units (JS string indexing), base64 uint32.
+    """
+    lower = [s.lower() for s in strings]
+    lengths = [len(s.encode('utf-16-le')) // 2 + 1 for s in lower]
+    return "\x00".join(lower), _b64(np.concatenate([[0], np.cumsum(lengths)]), np.uint32)
+
+
+def _layer_stats_np(flat, N, quantize):
+    """
+    Per-(batch, head) min/max, per-row min/max and (optionally) uint8
+    quantization of `flat`, the (B*H, N*N) float32 array of |attention|.
+    """
+    amin = flat.min(axis=1)
+    amax = flat.max(axis=1)
+    rows = flat.reshape(-1, N, N)
+    q = None
+    if quantize:
+        span = (amax - amin)[:, None]
+        q = np.round((flat - amin[:, None]) / np.where(span > 0, span, 1) * 255).astype(np.uint8)
+    return amin, amax, rows.min(axis=2), rows.max(axis=2), q
+
+
+@lru_cache(maxsize=None)
+def _numba_layer_stats():
+    """Compile (or load from numba's cache) the fused stats kernel, on first use only."""
+    try:
+        from numba import njit, prange
+    except ImportError:
+        raise ImportError("use_numba=True requires the numba package") from None
+
+    @njit(parallel=True, cache=True)
+    def _layer_stats_nb(flat, N, quantize):
+        # Same outputs as _layer_stats_np, fused into one pass per (batch, head).
+        # No fastmath: min/max must see infs and propagate NaNs as NumPy does
+        BH, NN = flat.shape
+        amin = np.empty(BH, np.float32)
+        amax = np.empty(BH, np.float32)
+        row_min = np.empty((BH, N), np.float32)
+        row_max = np.empty((BH, N), np.float32)
+        q = np.empty((BH, NN if quantize else 0), np.uint8)
+        for k in prange(BH):
+            for r in range(N):
+                rlo = rhi = flat[k, r * N]
+                for c in range(r * N + 1, r * N + N):
+                    v = flat[k, c]
+                    if v < rlo or v != v:
+                        rlo = v
+                    if v > rhi or v != v:
+                        rhi = v
+                row_min[k, r] = rlo
+                row_max[k, r] = rhi
+            lo, hi = row_min[k, 0], row_max[k, 0]
+            for r in range(1, N):
+                v = row_min[k, r]
+                if v < lo or v != v:
+                    lo = v
+                v = row_max[k, r]
+                if v > hi or v != v:
+                    hi = v
+            amin[k] = lo
+            amax[k] = hi
+            if quantize:
+                span = hi - lo if hi > lo else np.float32(1)
+                for i in range(NN):
+                    q[k, i] = np.uint8(round((flat[k, i] - lo) / span * np.float32(255)))
+        return amin, amax, row_min, row_max, q
+
+    return _layer_stats_nb
+
+
+def _prep_layer(t, top_k=_MAX_TL, quantize=True, use_numba=False):
+    """
+    Encode one (B, H, N, N) layer for the notebook script.
+
+    With `quantize`, |t| ships as uint8 scaled to each (batch, head)'s
+    [min, max] plus a packed sign bitmap (~4x smaller than float32);
+    otherwise as raw float32. Also ships per-(batch, head) min/max of |t|
+    and the `top_k` largest |t| entries sorted descending (flat r*N+c indices
+    plus values), so a threshold tick in JS is a binary search instead of an
+    N*N scan + sort. Per-row min/max of |t| (B*H*N) normalize chain segment
+    widths without a row scan.
+    """
+    B, H, N, _ = t.shape
+    t = np.asarray(t, dtype=np.float32)
+    flat = np.abs(t).reshape(B * H, N * N)
+    layer_stats = _numba_layer_stats() if use_numba else _layer_stats_np
+    amin, amax, row_min, row_max, q = layer_stats(flat, N, quantize)
+    k = min(top_k, N * N)
+    if k < N * N:
+        top = np.argpartition(-flat, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(N * N), flat.shape)
+    top_val = np.take_along_axis(flat, top, axis=1)
+    order = np.argsort(-top_val, axis=1, kind='stable')
+    if quantize:
+        attn = {'attn': _b64(q, np.uint8), 'sign': _b64(np.packbits(t.ravel() < 0), np.uint8)}
+    else:
+        attn = {'attn': _b64(t)}
+    return {
+        **attn,
+        'amin': _b64(amin),
+        'amax': _b64(amax),
+        'topIdx': _b64(np.take_along_axis(top, order, axis=1), np.uint32),
+        'topVal': _b64(np.take_along_axis(top_val, order, axis=1)),
+        'rowMin': _b64(row_min),
+        'rowMax': _b64(row_max),
+    }
+
+
+@lru_cache(maxsize=32)
+def _build_layout(L, nameBlockX, nameBlockW, guideGap, nodeW, colSpacing):
+    """
+    Column x-positions and the per-column node CSS for an `L`-layer graph.
+    The CSS is a template with a `{uid}` field, filled in per render.
+    """
+    col0_x = nameBlockX + nameBlockW + guideGap
+    colX = tuple(col0_x + i * colSpacing for i in range(L + 1))
+    col_css = "\n        ".join(
+        f".{{uid}}-ncol{c} {{{{ fill:{fill}; stroke:{stroke}; stroke-width:0.3; cursor:pointer; }}}}\n"
+        f"        .{{uid}}-ncol{c}:hover {{{{ fill:{hover}; }}}}"
+        for c, (fill, stroke, hover) in enumerate(_PALETTE[c % len(_PALETTE)] for c in range(L + 1)))
+    return colX, col_css
+
+
+class _AttentionGraph:
+    """Rendered graph handed to Jupyter as a single text/html mimebundle."""
+
+    def __init__(self, html):
+        self.html = html
+
+    def _repr_mimebundle_(self, include=None, exclude=None):
+        return {'text/html': self.html}
+
 
 def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, input_bounds,
-                         node_h=8, gap=1):
+                         node_h=8, gap=1, quantize=True, display_handle=None,
+                         return_handle=False, use_numba=False):
+    if use_numba:
+        _numba_layer_stats()  # numba is imported only here; raises ImportError without it
     L = len(attention_tensors)
     B, H, N, _ = attention_tensors[0].shape
     assert N == len(reaction_ids)
     input_bounds = np.array(input_bounds, dtype=float)
     assert input_bounds.shape == (B, N)
 
-    attn_data = [np.round(t, 6).tolist() for t in attention_tensors]
-    bounds_data = np.round(input_bounds, 6).tolist()
+    # One contiguous float32 buffer per layer (plus threshold index), decoded into typed arrays in JS
+    prep = partial(_prep_layer, quantize=quantize, use_numba=use_numba)
+    if not use_numba:
+        # Layers are independent and the NumPy work releases the GIL, so encode them concurrently
+        with ThreadPoolExecutor(max_workers=min(L, os.cpu_count() or 1)) as ex:
+            layer_data = list(ex.map(prep, attention_tensors))
+    else:
+        # The numba kernel already spans all cores, and must not be launched from worker threads
+        layer_data = [prep(t) for t in attention_tensors]
     full_names = [reaction_names_dict.get(rid, rid) for rid in reaction_ids]
 
     uid = f"av{random.randint(100000, 999999)}"
-    ids_json = json.dumps(reaction_ids)
-    fullnames_json = json.dumps(full_names)
-    attn_json = json.dumps(attn_data)
-    bounds_json = json.dumps(bounds_data)
-
-    num_cols = L + 1
-    col_colors = [_PALETTE[i % len(_PALETTE)] for i in range(num_cols)]
+    ids_lower, ids_offsets = _search_index(reaction_ids)
+    names_lower, names_offsets = _search_index(full_names)
 
     nameBlockX = 5
     nameBlockW = 200
@@ -63,8 +259,8 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
     colSpacing = 175
     sliderGroupW = 155
 
-    col0_x = nameBlockX + nameBlockW + guideGap
-    colX = [col0_x + i * colSpacing for i in range(L + 1)]
+    colX, col_css = _build_layout(L, nameBlockX, nameBlockW, guideGap, nodeW, colSpacing)
+    col_css = col_css.format(uid=uid)
     total_width = colX[-1] + nodeW + 30
 
     topPad = 50
@@ -75,11 +271,36 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
     bandX = nameBlockX
     bandW = colX[-1] + nodeW - nameBlockX
 
-    col_css = ""
-    for c, (fill, stroke, hover) in enumerate(col_colors):
-        col_css += f"""
-        .{uid}-ncol{c} {{ fill:{fill}; stroke:{stroke}; stroke-width:0.3; cursor:pointer; }}
-        .{uid}-ncol{c}:hover {{ fill:{hover}; }}"""
+    # Static SVG for name bars and node columns, parsed once by the browser
+    yPos = [topPad + i * (node_h + gap) for i in range(N)]
+    name_rows_svg = "".join(
+        f'<rect class="{uid}-nbg" x="{nameBlockX}" y="{y}" width="{nameBlockW}" height="{node_h}"/>'
+        f'<rect class="{uid}-nred" data-red="{i}" x="{nameBlockX}" y="{y}" width="0" height="{node_h}"/>'
+        f'<text class="{uid}-ntxt" x="{nameBlockX + 3}" y="{y + node_h - 1.5:g}">{escape(rid)}</text>'
+        f'<rect class="{uid}-nbar" data-nbar="{i}" x="{nameBlockX}" y="{y}" width="{nameBlockW}" height="{node_h}"/>'
+        f'<line class="{uid}-guide" x1="{nameBlockX + nameBlockW}" y1="{y + node_h / 2:g}" '
+        f'x2="{colX[0]}" y2="{y + node_h / 2:g}"/>'
+        for i, (rid, y) in enumerate(zip(reaction_ids, yPos)))
+    node_cols_svg = "".join(
+        f'<rect class="{uid}-ncol{col}" data-col="{col}" data-idx="{i}" x="{colX[col]}" y="{y}" '
+        f'width="{nodeW}" height="{node_h}" rx="1" ry="1"/>'
+        for col in range(L + 1) for i, y in enumerate(yPos))
+
+    # Red bar widths, normalized per batch by max |bound|; raw values kept for tooltips
+    abs_bounds = np.abs(input_bounds)
+    bounds_max = abs_bounds.max(axis=1, keepdims=True)
+    bound_widths = abs_bounds / np.where(bounds_max > 0, bounds_max, 1) * nameBlockW
+
+    # Everything the script needs from Python, written as one JSON object
+    payload = {
+        'ids': list(reaction_ids),
+        'fullNames': full_names,
+        'layers': layer_data,
+        'bounds': _b64(input_bounds, np.float64),
+        'widths': _b64(bound_widths),
+        'search': {'ids': ids_lower, 'idsOff': ids_offsets,
+                   'names': names_lower, 'namesOff': names_offsets},
+    }
 
     search_html = f"""
     <div id="{uid}-search-wrap" style="position:absolute; left:{nameBlockX}px; top:0px; width:{nameBlockW}px; z-index:10;">
@@ -116,31 +337,12 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
     </div>
     """
 
-    layer_sliders_html = ""
-    for l in range(L):
-        center = (colX[l] + nodeW + colX[l + 1]) / 2.0
-        left = center - sliderGroupW / 2.0
-        layer_sliders_html += f"""
-        <div style="position:absolute; left:{left:.0f}px; top:6px; width:{sliderGroupW}px;
-                     font-size:10px; color:#555; background:#f5f5f5; border:1px solid #ddd;
-                     border-radius:4px; padding:3px 6px; box-sizing:border-box;">
-          <div style="font-weight:bold; text-align:center; margin-bottom:2px; color:#333;">Layer {l}</div>
-          <div style="display:flex; align-items:center; gap:2px;">
-            <span style="min-width:14px;">H:</span>
-            <input id="{uid}-head-{l}" type="range" min="0" max="{H - 1}" value="0"
-                   style="flex:1; height:12px; cursor:pointer;" data-layer="{l}">
-            <span id="{uid}-hval-{l}" style="min-width:18px; text-align:right;">0</span>
-          </div>
-          <div style="display:flex; align-items:center; gap:2px;">
-            <span style="min-width:14px;">T:</span>
-            <input id="{uid}-thresh-{l}" type="range" min="0" max="1000" value="950"
-                   style="flex:1; height:12px; cursor:pointer;" data-layer="{l}">
-            <span id="{uid}-tval-{l}" style="min-width:50px; text-align:right; font-size:9px;"></span>
-          </div>
-        </div>
-        """
+    layer_sliders_html = "\n".join(
+        _LAYER_SLIDER_TMPL.format(uid=uid, l=l, hmax=H - 1, width=sliderGroupW,
+                                  left=(colX[l] + nodeW + colX[l + 1]) / 2.0 - sliderGroupW / 2.0)
+        for l in range(L))
 
-    html = f"""
+    markup = f"""
 <div id="{uid}-wrapper" style="width:{total_width}px; font-family:sans-serif;">
   <div style="position:relative; height:{sliderAreaH}px; overflow:visible;">
     {search_html}
@@ -148,12 +350,14 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
     {layer_sliders_html}
   </div>
   <div id="{uid}-scroll" style="width:{total_width}px; overflow-y:auto; border:1px solid #ccc; border-radius:0 0 6px 6px; background:#fafafa;">
-    <svg id="{uid}-svg" width="{total_width}" height="{svg_height}" xmlns="http://www.w3.org/2000/svg">
+   <div style="position:relative; width:{total_width}px; height:{svg_height}px;">
+    <canvas id="{uid}-canvas" style="position:absolute; left:0; top:0; width:{total_width}px; height:0;"></canvas>
+    <svg id="{uid}-svg" width="{total_width}" height="{svg_height}" xmlns="http://www.w3.org/2000/svg"
+         style="position:absolute; left:0; top:0;">
       <style>
         {col_css}
         .{uid}-hl {{ fill:none; stroke:#ff69b4; stroke-width:2; pointer-events:none; rx:2; ry:2; }}
         .{uid}-conn {{ stroke:#ff69b4; pointer-events:none; }}
-        .{uid}-tl {{ stroke:#aaa; pointer-events:none; }}
         .{uid}-tt {{ pointer-events:none; }}
         .{uid}-vl {{ pointer-events:none; font-size:9px; fill:#c0458a; font-weight:bold; }}
         .{uid}-nbg {{ fill:#1a1a1a; rx:1; ry:1; }}
@@ -165,24 +369,47 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
         .{uid}-rowband {{ fill:#d0d0d0; opacity:0.35; pointer-events:none; }}
         .{uid}-pinband {{ fill:#ffe066; opacity:0.38; pointer-events:none; }}
       </style>
+      <g id="{uid}-pinbands"></g>
+      <g id="{uid}-rowbands"></g>
+      <g id="{uid}-conns"></g>
+      <g id="{uid}-nodes">{name_rows_svg}{node_cols_svg}</g>
     </svg>
+   </div>
   </div>
 </div>
 
 <script>
 (function() {{
   const uid = "{uid}";
-  const ids = {ids_json};
-  const fullNames = {fullnames_json};
-  const attnData = {attn_json};
-  const boundsData = {bounds_json};
+  const data = """
+
+    script = f""";
+  const ids = data.ids;
+  const fullNames = data.fullNames;
+  function decode(b64, Type) {{
+    const bin = atob(b64);
+    const u8 = new Uint8Array(bin.length);
+    for (let i = 0; i < bin.length; i++) u8[i] = bin.charCodeAt(i);
+    return new Type(u8.buffer);
+  }}
+  const layers = data.layers.map(d => ({{
+    attn: d.sign ? decode(d.attn, Uint8Array) : decode(d.attn, Float32Array),
+    sign: d.sign ? decode(d.sign, Uint8Array) : null,
+    amin: decode(d.amin, Float32Array), amax: decode(d.amax, Float32Array),
+    topIdx: decode(d.topIdx, Uint32Array), topVal: decode(d.topVal, Float32Array),
+    rowMin: decode(d.rowMin, Float32Array), rowMax: decode(d.rowMax, Float32Array),
+  }}));
+  const boundsData = decode(data.bounds, Float64Array);
+  const boundWidths = decode(data.widths, Float32Array);
   const L = {L}, B = {B}, H = {H}, N = {N};
   const nodeH = {node_h}, nodeW = {nodeW}, gap = {gap};
   const nameBlockX = {nameBlockX}, nameBlockW = {nameBlockW};
   const topPad = {topPad};
   const colX = {json.dumps(colX)};
   const bandX = {bandX}, bandW = {bandW};
-  const MAX_TL = 600;
+  const totalW = {total_width}, svgH = {svg_height};
+  const NN = N * N;
+  const K = Math.min({_MAX_TL}, NN);
 
   const svgEl = document.getElementById(uid + '-svg');
   const scrollEl = document.getElementById(uid + '-scroll');
@@ -190,20 +417,18 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
 
   const yPos = [];
   for (let i = 0; i < N; i++) yPos.push(topPad + i * (nodeH + gap));
-  function cy(i) {{ return yPos[i] + nodeH / 2; }}
+  // Row centers, precomputed for the hot drawing loops
+  const cyPos = new Float32Array(N);
+  for (let i = 0; i < N; i++) cyPos[i] = yPos[i] + nodeH / 2;
 
   function elId(id) {{ return document.getElementById(uid + '-' + id); }}
   function curBatch() {{ return parseInt(elId('batch').value); }}
 
-  // ---- SVG groups ----
-  const pinBandGroup = document.createElementNS(ns, 'g'); svgEl.appendChild(pinBandGroup);
-  const bandGroup    = document.createElementNS(ns, 'g'); svgEl.appendChild(bandGroup);
-  const threshGroups = [];
-  for (let l = 0; l < L; l++) {{
-    const g = document.createElementNS(ns, 'g'); svgEl.appendChild(g); threshGroups.push(g);
-  }}
-  const connGroup = document.createElementNS(ns, 'g'); svgEl.appendChild(connGroup);
-  const nodeGroup = document.createElementNS(ns, 'g'); svgEl.appendChild(nodeGroup);
+  // ---- SVG groups (name bars and node columns are rendered from static markup) ----
+  const pinBandGroup = elId('pinbands');
+  const bandGroup    = elId('rowbands');
+  const connGroup = elId('conns');
+  const redRects = Array.from(elId('nodes').querySelectorAll('[data-red]'));
 
   // ---- Hover row band ----
   const rowBand = document.createElementNS(ns, 'rect');
@@ -242,56 +467,12 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
     if (pinnedRect) {{ pinnedRect.remove(); pinnedRect = null; }} pinnedIdx = -1;
   }}
 
-  // ---- Name bars ----
-  const redRects = [];
-  for (let i = 0; i < N; i++) {{
-    const y = yPos[i];
-    const bg = document.createElementNS(ns, 'rect');
-    bg.setAttribute('x', nameBlockX); bg.setAttribute('y', y);
-    bg.setAttribute('width', nameBlockW); bg.setAttribute('height', nodeH);
-    bg.classList.add(uid + '-nbg'); nodeGroup.appendChild(bg);
-
-    const red = document.createElementNS(ns, 'rect');
-    red.setAttribute('x', nameBlockX); red.setAttribute('y', y);
-    red.setAttribute('width', 0); red.setAttribute('height', nodeH);
-    red.classList.add(uid + '-nred'); nodeGroup.appendChild(red); redRects.push(red);
-
-    const txt = document.createElementNS(ns, 'text');
-    txt.setAttribute('x', nameBlockX + 3); txt.setAttribute('y', y + nodeH - 1.5);
-    txt.classList.add(uid + '-ntxt'); txt.textContent = ids[i]; nodeGroup.appendChild(txt);
-
-    const hit = document.createElementNS(ns, 'rect');
-    hit.setAttribute('x', nameBlockX); hit.setAttribute('y', y);
-    hit.setAttribute('width', nameBlockW); hit.setAttribute('height', nodeH);
-    hit.classList.add(uid + '-nbar'); hit.dataset.nbar = i; nodeGroup.appendChild(hit);
-
-    const gl = document.createElementNS(ns, 'line');
-    gl.setAttribute('x1', nameBlockX + nameBlockW); gl.setAttribute('y1', cy(i));
-    gl.setAttribute('x2', colX[0]); gl.setAttribute('y2', cy(i));
-    gl.classList.add(uid + '-guide'); nodeGroup.appendChild(gl);
-  }}
-
   function updateRedFills() {{
-    const b = curBatch(); const bv = boundsData[b];
-    let mx = -Infinity;
-    for (let i = 0; i < N; i++) if (Math.abs(bv[i]) > mx) mx = Math.abs(bv[i]);
-    if (mx <= 0) mx = 1;
-    for (let i = 0; i < N; i++) redRects[i].setAttribute('width', (Math.abs(bv[i]) / mx) * nameBlockW);
+    const off = curBatch() * N;
+    for (let i = 0; i < N; i++) redRects[i].setAttribute('width', boundWidths[off + i]);
   }}
   updateRedFills();
 
-  // ---- Node columns ----
-  for (let col = 0; col <= L; col++) {{
-    for (let i = 0; i < N; i++) {{
-      const r = document.createElementNS(ns, 'rect');
-      r.setAttribute('x', colX[col]); r.setAttribute('y', yPos[i]);
-      r.setAttribute('width', nodeW); r.setAttribute('height', nodeH);
-      r.setAttribute('rx', 1); r.setAttribute('ry', 1);
-      r.classList.add(uid + '-ncol' + col);
-      r.dataset.col = col; r.dataset.idx = i; nodeGroup.appendChild(r);
-    }}
-  }}
-
   // ---- Tooltip ----
   const ttRect = document.createElementNS(ns, 'rect');
   ttRect.classList.add(uid + '-tt');
@@ -336,42 +517,84 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
   }}
 
   // ---- Threshold ----
-  function getMatrix(l) {{
-    return attnData[l][curBatch()][parseInt(elId('head-' + l).value)];
+  function curSlice(l) {{ return curBatch() * H + parseInt(elId('head-' + l).value); }}
+  // Attention value at (r, c) of the active (batch, head) slice, dequantized if needed
+  function attnValue(l, r, c) {{
+    const lay = layers[l], bh = curSlice(l), i = bh * NN + r * N + c;
+    if (!lay.sign) return lay.attn[i];
+    const lo = lay.amin[bh], v = lo + lay.attn[i] * (lay.amax[bh] - lo) / 255;
+    return (lay.sign[i >> 3] >> (7 - (i & 7))) & 1 ? -v : v;
+  }}
+  // Threshold lines are painted on a canvas behind the SVG, bucketed into TL_BINS opacity bins.
+  // The canvas only spans the visible band of the graph (a full-height one passes browser canvas
+  // size limits for large N) and follows it on scroll
+  const canvas = elId('canvas'), ctx = canvas.getContext('2d');
+  const dpr = window.devicePixelRatio || 1;
+  const TL_BINS = 8;
+  let bandTop = 0, bandH = 0;
+  // Move/resize the canvas onto the visible band; returns true if it changed (and needs a redraw)
+  function placeCanvas() {{
+    const h = Math.min(svgH, Math.max(window.innerHeight, 200));
+    const top = Math.round(Math.max(0, Math.min(svgH - h, -canvas.parentNode.getBoundingClientRect().top)));
+    if (h === bandH && top === bandTop) return false;
+    if (h !== bandH) {{
+      bandH = h;
+      canvas.width = Math.round(totalW * dpr); canvas.height = Math.round(h * dpr);
+      canvas.style.height = h + 'px';
+    }}
+    bandTop = top;
+    canvas.style.top = top + 'px';
+    // Resizing resets the context state, so set it all again
+    ctx.setTransform(dpr, 0, 0, dpr, 0, -top * dpr);
+    ctx.strokeStyle = '#aaa'; ctx.lineWidth = 0.8;
+    return true;
+  }}
+  placeCanvas();
+  function onViewportChange() {{
+    if (!canvas.isConnected) {{  // output cleared
+      document.removeEventListener('scroll', onViewportChange, true);
+      window.removeEventListener('resize', onViewportChange);
+      return;
+    }}
+    raf('viewport', function() {{ if (placeCanvas()) updateAllThresh(); }});
   }}
+  // Capture phase: catches scrolling of any ancestor (notebook panes), not just the window
+  document.addEventListener('scroll', onViewportChange, true);
+  window.addEventListener('resize', onViewportChange);
   function updateThreshLines(l) {{
-    const g = threshGroups[l];
-    while (g.firstChild) g.removeChild(g.firstChild);
-    const m = getMatrix(l);
-    let mn = Infinity, mx = -Infinity;
-    for (let r = 0; r < N; r++)
-      for (let c = 0; c < N; c++) {{
-        const v = Math.abs(m[r][c]);
-        if (v < mn) mn = v; if (v > mx) mx = v;
-      }}
+    const lay = layers[l], bh = curSlice(l);
+    const mn = lay.amin[bh], mx = lay.amax[bh];
     const sv = parseInt(elId('thresh-' + l).value);
     const thresh = mn + (sv / 1000) * (mx - mn);
     elId('tval-' + l).textContent = thresh.toExponential(2);
-    const entries = [];
-    for (let r = 0; r < N; r++)
-      for (let c = 0; c < N; c++) {{
-        const v = Math.abs(m[r][c]);
-        if (v >= thresh) entries.push({{ r, c, v }});
-      }}
-    entries.sort((a, b) => b.v - a.v);
-    const drawn = entries.slice(0, MAX_TL);
+    // Top-K |m| values are sorted descending: count those >= thresh
+    const base = bh * K, vals = lay.topVal, idxs = lay.topIdx;
+    let lo = 0, hi = K;
+    while (lo < hi) {{
+      const mid = (lo + hi) >> 1;
+      if (vals[base + mid] >= thresh) lo = mid + 1; else hi = mid;
+    }}
     const range = mx - thresh;
+    const binScale = range > 0 ? TL_BINS / range : 0;
     const x1 = colX[l] + nodeW, x2 = colX[l + 1];
-    for (const e of drawn) {{
-      let alpha = 0.08;
-      if (range > 0) alpha = 0.05 + ((e.v - thresh) / range) * 0.45;
-      const line = document.createElementNS(ns, 'line');
-      line.setAttribute('x1', x1); line.setAttribute('y1', cy(e.r));
-      line.setAttribute('x2', x2); line.setAttribute('y2', cy(e.c));
-      line.setAttribute('stroke-width', 0.8);
-      line.setAttribute('stroke-opacity', alpha);
-      line.classList.add(uid + '-tl'); g.appendChild(line);
+    ctx.clearRect(x1 - 1, bandTop, x2 - x1 + 2, bandH);
+    const bandEnd = bandTop + bandH;
+    // Entries are sorted descending, so each bin is a contiguous run: one stroke per bin
+    let bin = -1;
+    for (let i = 0; i < lo; i++) {{
+      const rc = idxs[base + i], r = (rc / N) | 0, c = rc - r * N;
+      const y1 = cyPos[r], y2 = cyPos[c];
+      if ((y1 < bandTop && y2 < bandTop) || (y1 > bandEnd && y2 > bandEnd)) continue;
+      const b = Math.min(TL_BINS - 1, Math.floor((vals[base + i] - thresh) * binScale));
+      if (b !== bin) {{
+        if (bin >= 0) ctx.stroke();
+        bin = b;
+        ctx.globalAlpha = 0.05 + ((b + 0.5) / TL_BINS) * 0.45;
+        ctx.beginPath();
+      }}
+      ctx.moveTo(x1, y1); ctx.lineTo(x2, y2);
     }}
+    if (bin >= 0) ctx.stroke();
   }}
   function updateAllThresh() {{ for (let l = 0; l < L; l++) updateThreshLines(l); }}
 
@@ -380,12 +603,14 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
   // ============================================================
   let chain = [];
   let hlRects = [];
-  let segments = [];
+  // Chain segments reuse a pool of <line>/<text> pairs; redraws only touch attributes
+  const segPool = [];
+  let segCount = 0;
 
   function clearChain() {{
     hlRects.forEach(r => r.remove());
-    segments.forEach(s => s.forEach(a => a.remove()));
-    hlRects = []; segments = []; chain = [];
+    hideSegmentsFrom(0);
+    hlRects = []; segCount = 0; chain = [];
   }}
 
   function makeHL(col, idx) {{
@@ -400,54 +625,52 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
     return rect;
   }}
 
-  function makeSegment(keyCol, keyIdx, queryIdx) {{
-    const l = keyCol;
-    const m = getMatrix(l);
-    const val = m[keyIdx][queryIdx];
-    let rmin = Infinity, rmax = -Infinity;
-    for (let c = 0; c < N; c++) {{
-      const v = Math.abs(m[keyIdx][c]);
-      if (v < rmin) rmin = v; if (v > rmax) rmax = v;
-    }}
-    let normed = 0.5;
-    if (rmax > rmin) normed = (Math.abs(val) - rmin) / (rmax - rmin);
-    const lw = 0.3 + normed * 7.7;
-    const alpha = 0.2 + normed * 0.45;
-    const arts = [];
-
+  function mkPool() {{
     const line = document.createElementNS(ns, 'line');
-    line.setAttribute('x1', colX[l] + nodeW); line.setAttribute('y1', cy(keyIdx));
-    line.setAttribute('x2', colX[l + 1]); line.setAttribute('y2', cy(queryIdx));
-    line.setAttribute('stroke-width', lw); line.setAttribute('stroke-opacity', alpha);
     line.classList.add(uid + '-conn');
-    connGroup.appendChild(line); arts.push(line);
-
-    const midx = (colX[l] + nodeW + colX[l + 1]) / 2;
-    const midy = (cy(keyIdx) + cy(queryIdx)) / 2;
+    connGroup.appendChild(line);
     const lbl = document.createElementNS(ns, 'text');
-    lbl.setAttribute('x', midx); lbl.setAttribute('y', midy - 4);
     lbl.setAttribute('text-anchor', 'middle');
     lbl.classList.add(uid + '-vl');
-    lbl.textContent = val.toExponential(3);
-    svgEl.appendChild(lbl); arts.push(lbl);
-    return arts;
+    svgEl.appendChild(lbl);
+    return {{ line, lbl }};
+  }}
+
+  function updateSegment(i, keyCol, keyIdx, queryIdx) {{
+    const s = segPool[i] || (segPool[i] = mkPool());
+    const l = keyCol;
+    const val = attnValue(l, keyIdx, queryIdx);
+    const ri = curSlice(l) * N + keyIdx;
+    const rmin = layers[l].rowMin[ri], rmax = layers[l].rowMax[ri];
+    let normed = 0.5;
+    if (rmax > rmin) normed = Math.min(1, Math.max(0, (Math.abs(val) - rmin) / (rmax - rmin)));
+    const x1 = colX[l] + nodeW, x2 = colX[l + 1];
+    const y1 = cyPos[keyIdx], y2 = cyPos[queryIdx];
+
+    s.line.setAttribute('x1', x1); s.line.setAttribute('y1', y1);
+    s.line.setAttribute('x2', x2); s.line.setAttribute('y2', y2);
+    s.line.style.strokeWidth = 0.3 + normed * 7.7;
+    s.line.style.strokeOpacity = 0.2 + normed * 0.45;
+    s.lbl.setAttribute('x', (x1 + x2) / 2); s.lbl.setAttribute('y', (y1 + y2) / 2 - 4);
+    s.lbl.textContent = val.toExponential(3);
+    s.line.style.visibility = s.lbl.style.visibility = '';
+  }}
+
+  function hideSegmentsFrom(i) {{
+    for (; i < segPool.length; i++) segPool[i].line.style.visibility = segPool[i].lbl.style.visibility = 'hidden';
   }}
 
   function redrawSegmentAt(i) {{
-    if (i < 0 || i >= segments.length) return;
-    segments[i].forEach(a => a.remove());
-    segments[i] = makeSegment(chain[i].col, chain[i].idx, chain[i + 1].idx);
+    if (i < 0 || i >= segCount) return;
+    updateSegment(i, chain[i].col, chain[i].idx, chain[i + 1].idx);
   }}
 
   function redrawAllSegments() {{
-    for (let i = 0; i < segments.length; i++) {{
-      segments[i].forEach(a => a.remove());
-      segments[i] = makeSegment(chain[i].col, chain[i].idx, chain[i + 1].idx);
-    }}
+    for (let i = 0; i < segCount; i++) redrawSegmentAt(i);
   }}
 
   function redrawSegmentsForLayer(l) {{
-    for (let i = 0; i < segments.length; i++) {{
+    for (let i = 0; i < segCount; i++) {{
       if (chain[i].col === l) redrawSegmentAt(i);
     }}
   }}
@@ -456,43 +679,44 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
     const prev = chain[chain.length - 1];
     chain.push({{ col, idx }});
     hlRects.push(makeHL(col, idx));
-    segments.push(makeSegment(prev.col, prev.idx, idx));
+    updateSegment(segCount++, prev.col, prev.idx, idx);
   }}
 
   function truncateFrom(pos) {{
     while (hlRects.length > pos) hlRects.pop().remove();
-    const segCut = Math.max(0, pos - 1);
-    while (segments.length > segCut) segments.pop().forEach(a => a.remove());
+    segCount = Math.min(segCount, Math.max(0, pos - 1));
+    hideSegmentsFrom(segCount);
     chain.length = pos;
   }}
 
   function replaceAt(pos, col, idx) {{
     hlRects[pos].remove();
     hlRects[pos] = makeHL(col, idx);
-    if (pos > 0) {{
-      segments[pos - 1].forEach(a => a.remove());
-      segments[pos - 1] = makeSegment(chain[pos - 1].col, chain[pos - 1].idx, idx);
-    }}
-    if (pos < chain.length - 1) {{
-      segments[pos].forEach(a => a.remove());
-      segments[pos] = makeSegment(col, idx, chain[pos + 1].idx);
-    }}
+    if (pos > 0) updateSegment(pos - 1, chain[pos - 1].col, chain[pos - 1].idx, idx);
+    if (pos < chain.length - 1) updateSegment(pos, col, idx, chain[pos + 1].idx);
     chain[pos] = {{ col, idx }};
   }}
 
   // ---- Slider wiring ----
+  // Redraws are coalesced to at most one per animation frame per key
+  const pending = {{}};
+  function raf(key, fn) {{
+    if (pending[key]) return;
+    pending[key] = true;
+    requestAnimationFrame(function() {{ pending[key] = false; fn(); }});
+  }}
   elId('batch').addEventListener('input', function() {{
     elId('bval').textContent = this.value;
-    updateRedFills(); updateAllThresh(); redrawAllSegments();
+    raf('batch', function() {{ updateRedFills(); updateAllThresh(); redrawAllSegments(); }});
   }});
   for (let l = 0; l < L; l++) {{
     (function(layer) {{
       elId('head-' + layer).addEventListener('input', function() {{
         elId('hval-' + layer).textContent = this.value;
-        updateThreshLines(layer); redrawSegmentsForLayer(layer);
+        raf('head-' + layer, function() {{ updateThreshLines(layer); redrawSegmentsForLayer(layer); }});
       }});
       elId('thresh-' + layer).addEventListener('input', function() {{
-        updateThreshLines(layer);
+        raf('thresh-' + layer, function() {{ updateThreshLines(layer); }});
       }});
     }})(l);
   }}
@@ -556,7 +780,7 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
       showRowBand(idx);
       const rx = parseFloat(t.getAttribute('x'));
       const ry = parseFloat(t.getAttribute('y'));
-      const bv = boundsData[curBatch()][idx];
+      const bv = boundsData[curBatch() * N + idx];
       showTooltip(rx + nameBlockW + 8, ry + nodeH / 2, 'start',
                   fullNames[idx], 'Bound: ' + bv.toExponential(3));
       return;
@@ -576,19 +800,39 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
   //  SEARCH BAR
   // ============================================================
   const dropdown = elId('dropdown');
-  const idsLower = ids.map(s => s.toLowerCase());
-  const fullNamesLower = fullNames.map(s => s.toLowerCase());
+  // Lowercased ids / full names, each concatenated into one NUL-separated string
+  const search = data.search;
+  const idsOff = decode(search.idsOff, Uint32Array);
+  const namesOff = decode(search.namesOff, Uint32Array);
+
+  // Index of the entry containing string position pos (last i with off[i] <= pos)
+  function entryAt(off, pos) {{
+    let lo = 0, hi = N - 1;
+    while (lo < hi) {{
+      const mid = (lo + hi + 1) >> 1;
+      if (off[mid] <= pos) lo = mid; else hi = mid - 1;
+    }}
+    return lo;
+  }}
 
   function getMatches(query) {{
     if (!query) return [];
     const q = query.toLowerCase();
+    const scores = new Uint8Array(N);
     const scored = [];
-    for (let i = 0; i < N; i++) {{
-      let score = -1;
-      if (idsLower[i].startsWith(q)) score = 3;
-      else if (idsLower[i].includes(q)) score = 2;
-      else if (fullNamesLower[i].includes(q)) score = 1;
-      if (score > 0) scored.push({{ idx: i, score }});
+    // First hit in an entry is its leftmost one; then skip to the next entry
+    let p = search.ids.indexOf(q);
+    while (p !== -1) {{
+      const i = entryAt(idsOff, p);
+      scores[i] = p === idsOff[i] ? 3 : 2;
+      scored.push({{ idx: i, score: scores[i] }});
+      p = search.ids.indexOf(q, idsOff[i + 1]);
+    }}
+    p = search.names.indexOf(q);
+    while (p !== -1) {{
+      const i = entryAt(namesOff, p);
+      if (!scores[i]) scored.push({{ idx: i, score: 1 }});
+      p = search.names.indexOf(q, namesOff[i + 1]);
     }}
     scored.sort((a, b) => b.score - a.score || a.idx - b.idx);
     return scored.slice(0, 12);
@@ -668,4 +912,18 @@ def show_attention_graph(reaction_ids, reaction_names_dict, attention_tensors, i
 }})();
 </script>
 """
-    display(HTML(html))
+    # Stream the pieces into one buffer rather than interpolating the payload into an f-string
+    buf = io.StringIO()
+    buf.write(markup)
+    _write_json(payload, buf)
+    buf.write(script)
+    view = _AttentionGraph(buf.getvalue())
+    # Re-render into an existing output in place when given its handle
+    if display_handle is not None:
+        display_handle.update(view)
+    elif return_handle:
+        display_handle = display(view, display_id=True)
+    else:
+        display(view)
+    # Only return the handle on request, so a bare call doesn't echo it as the cell's Out[]
+    return display_handle if return_handle else None
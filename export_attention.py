@@ -3,7 +3,7 @@ Export attention data to optimized binary format (.attnbin) for the web visualiz
 
 Binary layout:
     [4 bytes]  header_length (uint32 LE)
-    [H bytes]  JSON header (UTF-8)
+    [H bytes]  JSON header (UTF-8), or msgpack with msgpack_header=True
     [B*N*4]    input_bounds (float32, row-major)
     [B*H*N*N*4] layer_0 attention (float32)
     [B*H*N*N*4] layer_1 attention (float32)
@@ -13,6 +13,25 @@ The web visualizer reads slices as zero-copy Float32Array views,
 so only the active (batch, head) slice (~160KB for N=200) is ever
 touched at render time.
 
+With codec='zlib' the attention layers are instead stored compressed,
+one chunk per (layer, batch, head) slice:
+    [L*B*H*4]  compressed chunk sizes (uint32 LE, layer-major)
+    [...]      chunks, each the slice's bytes shuffled by byte position
+               (all first bytes, then all second bytes, ...) then deflated
+Chunk offsets follow from the size table, so any one slice can still be
+read without touching the others.
+
+With layout='BHLNN' (header "layout", format 'attnbin_v2') the same slices are ordered
+batch, head, layer instead: [H*L*N*N*4] batch_0 (head_0 layers 0..L-1,
+head_1 ...), batch_1, ... and likewise for the zlib chunks.
+
+export_attention_chunked writes all batches to one file in chunks
+(format 'attnbin_v2'): one header (with B the total batch count) carrying a `chunks` table of
+[byte_offset, byte_length] per chunk, then the chunks back to back, each
+laid out like the body of a file of just its batches (bounds, then layers).
+export_attention_streaming writes the same layout, but with chunks of
+`batch_bytes` per batch in place of the table.
+
 Usage:
     from export_attention import export_attention_data
     export_attention_data(
@@ -24,29 +43,122 @@ Usage:
     )
 """
 
+import errno
+import itertools
 import json
-import struct
+import mmap
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import numpy as np
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
-def export_attention_data(filepath, reaction_ids, reaction_names_dict,
-                          attention_tensors, input_bounds):
+_CODECS = (None, 'zlib')
+
+# Slice order of the layers: layer-major, or all layers of a (batch, head) together
+_LAYOUTS = ('LBHNN', 'BHLNN')
+
+# Header keys that change where the slices are in the body. Files using any
+# of them are 'attnbin_v2', so v1 readers reject them instead of misreading
+_V2_KEYS = ('layout', 'chunks', 'batch_bytes')
+
+# Output buffer size; writes are one tile at a time, so this keeps syscalls few
+_WRITE_BUFFER = 8 << 20
+
+# Target size of one cast-and-write tile, small enough to stay cache resident
+_TILE_BYTES = 1 << 20
+
+# posix_fallocate errors meaning "not supported here"; anything else (ENOSPC, EFBIG) is real
+_FALLOCATE_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL)
+
+# Header bytes reserved per entry of a chunked file's chunk table,
+# enough for "[offset,length]," with both up to 2**53
+_CHUNK_ENTRY_BYTES = 36
+
+
+def _full_names(reaction_ids, reaction_names_dict):
+    """Full name per ID, falling back to the ID itself."""
+    return list(map(reaction_names_dict.get, reaction_ids, reaction_ids))
+
+
+def _batch_selector(batch_indices, B):
     """
-    Export attention data to a compact binary file for the web visualizer.
+    A slice equivalent to `batch_indices` when they form an arithmetic
+    progression of integers within [0, B) (ranges, contiguous runs,
+    strides), so indexing returns a view; otherwise the indices as a list
+    for fancy indexing, which also keeps boolean masks and its IndexError
+    for out-of-range indices.
+    """
+    if isinstance(batch_indices, slice):
+        return batch_indices
+    batch_indices = list(batch_indices)
+    idx = np.asarray(batch_indices)
+    if idx.ndim == 1 and idx.dtype.kind in 'iu' and len(idx) and idx.min() >= 0 and idx.max() < B:
+        step = int(idx[1] - idx[0]) if len(idx) > 1 else 1
+        if step > 0 and np.array_equal(idx, np.arange(idx[0], idx[-1] + 1, step)):
+            return slice(int(idx[0]), int(idx[-1]) + 1, step)
+    return batch_indices
+
+
+def _pack_header(meta, use_msgpack=False):
+    """
+    Encode the header dict as compact JSON or, if `use_msgpack`, as msgpack
+    (advertised as format 'attnbin_v2_msgpack'). JSON headers using any of
+    _V2_KEYS are advertised as 'attnbin_v2'.
+    """
+    if not use_msgpack:
+        if any(k in meta for k in _V2_KEYS):
+            meta = {**meta, 'format': 'attnbin_v2'}
+        return json.dumps(meta, separators=(',', ':')).encode('utf-8')
+    if msgpack is None:
+        raise ImportError("msgpack_header=True requires the msgpack package")
+    return msgpack.packb({**meta, 'format': 'attnbin_v2_msgpack'}, use_bin_type=True)
 
-    Parameters
-    ----------
-    filepath : str
-        Output path (recommended extension: .attnbin).
-    reaction_ids : list of str, length N
-        Short reaction identifiers (embedding labels).
-    reaction_names_dict : dict
-        Mapping from short ID to full human-readable name.
-    attention_tensors : list of L numpy arrays
-        Each array has shape (B, H, N, N) — float32 or float64.
-    input_bounds : array-like, shape (B, N)
-        Per-sample per-reaction bound values.
+
+def _tiles(t, itemsize):
+    """
+    Yield consecutive slices of a (B, H, N, N) array, in file order, each
+    about _TILE_BYTES once cast to `itemsize` bytes per value.
     """
+    B, H, N, _ = t.shape
+    per_batch = H * N * N * itemsize
+    if per_batch <= _TILE_BYTES:
+        step = _TILE_BYTES // per_batch
+        for b0 in range(0, B, step):
+            yield t[b0:b0 + step]
+    else:
+        step = max(1, _TILE_BYTES // (N * N * itemsize))
+        for b in range(B):
+            for h0 in range(0, H, step):
+                yield t[b, h0:h0 + step]
+
+
+def _is_stored_as(t, dtype):
+    """True if `t` is a C-contiguous ndarray of `dtype`, i.e. writable as is."""
+    return isinstance(t, np.ndarray) and t.dtype == dtype and t.flags.c_contiguous
+
+
+def _copy_layer(dst, t):
+    """
+    np.copyto under the default 'same_kind' rule, except for bfloat16 layers
+    (ml_dtypes), which NumPy only lets narrow to float16 as an unsafe cast.
+    """
+    np.copyto(dst, t, casting='unsafe' if str(t.dtype) == 'bfloat16' else 'same_kind')
+
+
+def _compress_slice(a):
+    """Byte-shuffle a contiguous array, then deflate it (zlib stream)."""
+    shuffled = a.view(np.uint8).reshape(-1, a.itemsize).T.tobytes()
+    return zlib.compress(shuffled, 5)
+
+
+def _validate(reaction_ids, attention_tensors, input_bounds):
+    """Check input shapes; return (L, B, H, N) and the bounds as float32."""
     L = len(attention_tensors)
     B, H, N, _ = attention_tensors[0].shape
     assert len(reaction_ids) == N, \
@@ -56,191 +168,804 @@ def export_attention_data(filepath, reaction_ids, reaction_names_dict,
     assert input_bounds.shape == (B, N), \
         f"input_bounds shape {input_bounds.shape} != ({B}, {N})"
 
-    # Validate all layers
-    for i, t in enumerate(attention_tensors):
-        assert t.shape == (B, H, N, N), \
-            f"Layer {i} shape {t.shape} != ({B}, {H}, {N}, {N})"
-
-    full_names = [reaction_names_dict.get(rid, rid) for rid in reaction_ids]
-
-    header = json.dumps({
+    # Validate all layers with one comparison (once all are 4-D, so the shapes stack)
+    ndims = np.array([len(t.shape) for t in attention_tensors])
+    bad = np.flatnonzero(ndims != 4)
+    if not len(bad):
+        shapes = np.array([t.shape for t in attention_tensors])
+        bad = np.flatnonzero((shapes != (B, H, N, N)).any(axis=1))
+    assert not len(bad), \
+        f"Layer {bad[0]} shape {attention_tensors[bad[0]].shape} != ({B}, {H}, {N}, {N})"
+    return (L, B, H, N), input_bounds
+
+
+def _header_meta(dims, reaction_ids, full_names, dtype, codec=None, group_size=None,
+                 threshold=None, layout='LBHNN'):
+    """Header dict for a file of the given (L, B, H, N) and encoding."""
+    L, B, H, N = dims
+    meta = {
         'format': 'attnbin_v1',
         'N': int(N),
         'B': int(B),
         'H': int(H),
         'L': int(L),
-        'reaction_ids': list(reaction_ids),
-        'full_names': full_names,
-    }, separators=(',', ':')).encode('utf-8')
+    }
+    if dtype != 'float32':
+        meta['dtype'] = dtype
+    if group_size:
+        meta['group_size'] = int(group_size)
+    if threshold is not None:
+        meta['threshold'] = float(threshold)
+    if layout != 'LBHNN':
+        meta['layout'] = layout
+    meta['reaction_ids'] = list(reaction_ids)
+    meta['full_names'] = full_names
+    if codec:
+        meta['codec'] = codec
+    return meta
+
+
+def _payload_sizes(dims, dtype, group_size=None):
+    """(scale table bytes, bytes per layer) of the uncompressed encoding."""
+    L, B, H, N = dims
+    if dtype == 'uint8_affine':
+        return 2 * L * B * H * 4, B * H * N * N
+    if dtype == 'int4_affine':
+        G = -(-N // group_size)
+        return 2 * L * B * H * N * G * 2, B * H * ((N * N + 1) // 2)
+    return 0, B * H * N * N * np.dtype(dtype).itemsize
+
+
+def _write_raw_layers(f, attention_tensors, dtype, layout='LBHNN'):
+    if layout == 'BHLNN':
+        # One batch at a time, (H, L, N, N), gathered into a reused buffer
+        B, H, N, _ = attention_tensors[0].shape
+        out = np.empty((H, len(attention_tensors), N, N), dtype=dtype)
+        for b in range(B):
+            for l, t in enumerate(attention_tensors):
+                _copy_layer(out[:, l], t[b])
+            out.tofile(f)
+        return
+    # Layers already stored as `dtype` go out in one write from their own
+    # buffer; others are cast and written in ~1 MB tiles rather than
+    # materializing a whole cast layer
+    itemsize = np.dtype(dtype).itemsize
+    as_is = [_is_stored_as(t, dtype) for t in attention_tensors]
+    for t, direct in zip(attention_tensors, as_is):
+        if direct:
+            t.tofile(f)
+            continue
+        for tile in _tiles(t, itemsize):
+            np.ascontiguousarray(tile, dtype=dtype).tofile(f)
+
+
+def _map_raw_layers(f, attention_tensors, dtype, layout='LBHNN'):
+    """
+    Grow the file to its final size and np.copyto each layer straight into
+    a shared mapping of it, casting on the fly (a plain memcpy when a layer
+    already has `dtype`). No intermediate buffers; the kernel writes the
+    dirty pages back on its own schedule. Layers land in disjoint regions
+    (interleaved per (batch, head) with layout='BHLNN') and NumPy's
+    copy/cast loops release the GIL, so they are filled concurrently.
+    Only for files whose blocks are already allocated: a page that can't be
+    backed on disk faults with SIGBUS instead of raising ENOSPC.
+    Returns the file size.
+    """
+    start = f.tell()
+    L = len(attention_tensors)
+    B, H, N, _ = attention_tensors[0].shape
+    count = L * B * H * N * N
+    size = start + count * np.dtype(dtype).itemsize
+    f.flush()
+    # Only ever grow: the file may already be preallocated past this point
+    if os.fstat(f.fileno()).st_size < size:
+        os.ftruncate(f.fileno(), size)
+    with mmap.mmap(f.fileno(), size) as mm:
+        out = np.frombuffer(mm, dtype=dtype, count=count, offset=start)
+        if layout == 'BHLNN':
+            out = out.reshape(B, H, L, N, N)
+            dsts = [out[:, :, l] for l in range(L)]
+        else:
+            dsts = list(out.reshape(L, B, H, N, N))
+        del out
+        try:
+            workers = min(len(dsts), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                list(ex.map(_copy_layer, dsts, attention_tensors))
+        finally:
+            del dsts  # the mapping can't close while views of it exist
+    f.seek(size)
+    return size
+
+
+def _write_compressed_layers(f, attention_tensors, dtype, layout='LBHNN'):
+    """
+    Write the chunk size table followed by one compressed chunk per
+    (layer, batch, head) slice, in `layout` order. The table is written as
+    zeros first and filled in once all chunk sizes are known.
+    """
+    L = len(attention_tensors)
+    B, H = attention_tensors[0].shape[:2]
+    sizes = np.zeros(L * B * H, dtype='<u4')
+    table_pos = f.tell()
+    f.write(sizes.tobytes())
+    direct = [_is_stored_as(t, dtype) for t in attention_tensors]
+    if layout == 'BHLNN':
+        order = ((l, b, h) for b in range(B) for h in range(H) for l in range(L))
+    else:
+        order = ((l, b, h) for l in range(L) for b in range(B) for h in range(H))
+    for i, (l, b, h) in enumerate(order):
+        t = attention_tensors[l]
+        a = t[b, h] if direct[l] else np.ascontiguousarray(t[b, h], dtype=dtype)
+        chunk = _compress_slice(a)
+        f.write(chunk)
+        sizes[i] = len(chunk)
+    end = f.tell()
+    f.seek(table_pos)
+    f.write(sizes.tobytes())
+    f.seek(end)
+
+
+def _write_int8_layers(f, attention_tensors):
+    L = len(attention_tensors)
+    B, H = attention_tensors[0].shape[:2]
+    # Per-slice ranges, needed up front since the tables precede the payload
+    offset = np.empty((L, B, H), dtype=np.float32)
+    scale = np.empty((L, B, H), dtype=np.float32)
+    for l, t in enumerate(attention_tensors):
+        t = np.asarray(t)
+        offset[l] = t.min(axis=(2, 3))
+        scale[l] = (t.max(axis=(2, 3)) - offset[l]) / 255
+    divisor = np.where(scale > 0, scale, 1)
+
+    scale.tofile(f)
+    offset.tofile(f)
+    for l, t in enumerate(attention_tensors):
+        for b in range(B):
+            q = (np.asarray(t[b], dtype=np.float32) - offset[l, b, :, None, None]) \
+                / divisor[l, b, :, None, None]
+            np.clip(np.rint(q), 0, 255).astype(np.uint8).tofile(f)
+
+
+def _write_int4_layers(f, attention_tensors, group_size):
+    L = len(attention_tensors)
+    B, H, N, _ = attention_tensors[0].shape
+    G = -(-N // group_size)
+    # Scale/bias tables precede the codes but are only known once every
+    # batch is quantized, so they are filled in after the payload
+    scale = np.zeros((L, B, H, N, G), dtype=np.float16)
+    bias = np.zeros((L, B, H, N, G), dtype=np.float16)
+    pad = G * group_size - N
+    table_pos = f.tell()
+    f.write(bytes(scale.nbytes + bias.nbytes))
+    for l, t in enumerate(attention_tensors):
+        for b in range(B):
+            x = np.asarray(t[b], dtype=np.float32)
+            # Edge padding completes the last group without changing its min/max
+            g = np.pad(x, ((0, 0), (0, 0), (0, pad)), mode='edge').reshape(H, N, G, group_size)
+            lo = g.min(axis=3)
+            bias[l, b] = lo
+            scale[l, b] = (g.max(axis=3) - lo) / 15
+            s16 = scale[l, b].astype(np.float32)
+            q = (g - bias[l, b].astype(np.float32)[..., None]) / np.where(s16 > 0, s16, 1)[..., None]
+            q = np.clip(np.rint(q), 0, 15).astype(np.uint8)
+            q = q.reshape(H, N, G * group_size)[:, :, :N].reshape(H, N * N)
+            if N * N % 2:
+                q = np.pad(q, ((0, 0), (0, 1)))
+            (q[:, 0::2] | (q[:, 1::2] << 4)).tofile(f)
+    end = f.tell()
+    f.seek(table_pos)
+    scale.tofile(f)
+    bias.tofile(f)
+    f.seek(end)
+
+
+def _write_sparse_layers(f, attention_tensors, threshold):
+    """
+    Write the kept-count table followed by one variable-size record per
+    (layer, batch, head) slice: a bitmap of the entries with
+    |value| > threshold (np.packbits per row), then those values as fp16 in
+    row-major order. The table is written as zeros first and filled in once
+    all counts are known.
+    """
+    B, H = attention_tensors[0].shape[:2]
+    counts = np.zeros(len(attention_tensors) * B * H, dtype='<u4')
+    table_pos = f.tell()
+    f.write(counts.tobytes())
+    i = 0
+    for t in attention_tensors:
+        for b in range(B):
+            x = np.asarray(t[b], dtype=np.float32)
+            mask = np.abs(x) > threshold
+            bits = np.packbits(mask, axis=2)
+            for h in range(H):
+                kept = x[h][mask[h]].astype(np.float16)
+                f.write(bits[h].tobytes())
+                f.write(kept.tobytes())
+                counts[i] = kept.size
+                i += 1
+    end = f.tell()
+    f.seek(table_pos)
+    f.write(counts.tobytes())
+    f.seek(end)
+
+
+def _write_prologue(f, header, input_bounds):
+    """
+    Write the length prefix, header and bounds to the freshly opened `f`,
+    as a single gather write (one syscall) where os.writev is available.
+    """
+    parts = [len(header).to_bytes(4, 'little'), header,
+             np.ascontiguousarray(input_bounds).view(np.uint8).ravel()]
+    if not hasattr(os, 'writev'):
+        for p in parts:
+            f.write(p)
+        return
+    f.flush()
+    n = os.writev(f.fileno(), parts)
+    # Resync the buffered file with the descriptor, then finish any short write
+    f.seek(n)
+    for p in parts:
+        if n < len(p):
+            f.write(memoryview(p)[n:])
+            n = 0
+        else:
+            n -= len(p)
+
+
+def _prepare_output(f, size=None):
+    """
+    Hint the kernel that `f` is written sequentially and, if its final
+    `size` is known, allocate all of its blocks up front (contiguous
+    extents instead of allocating on every write). POSIX only; running out
+    of space raises, an unsupported call is skipped.
+    Returns whether all `size` bytes were allocated.
+    """
+    fd = f.fileno()
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass  # only a hint
+    if not size or not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        if e.errno not in _FALLOCATE_UNSUPPORTED:
+            raise
+        return False  # e.g. unsupported by the filesystem: blocks are allocated as written
+    return True
+
+
+def _write_attnbin(filepath, header, input_bounds, attention_tensors, dtype,
+                   codec=None, group_size=None, threshold=None, layout='LBHNN'):
+    """
+    Write one .attnbin file from already validated inputs: the packed
+    `header`, float32 bounds, then the layers encoded as `dtype`.
+    Returns the file size in bytes.
+    """
+    # Final size, unless compression or sparsity make it data dependent
+    size = None
+    if not codec and dtype != 'sparse_fp16':
+        dims = (len(attention_tensors),) + tuple(attention_tensors[0].shape[:3])
+        table_bytes, layer_bytes = _payload_sizes(dims, dtype, group_size)
+        size = 4 + len(header) + input_bounds.nbytes + table_bytes + dims[0] * layer_bytes
+    # Read/write mode: a shared writable mapping needs a descriptor open for reading too
+    with open(filepath, 'w+b', buffering=_WRITE_BUFFER) as f:
+        allocated = _prepare_output(f, size)
+        # Header length (uint32 little-endian), header, input bounds
+        _write_prologue(f, header, input_bounds)
+        _write_layers(f, attention_tensors, dtype, codec, group_size, threshold, layout,
+                      allocated)
+        return f.tell()
+
+
+def _write_layers(f, attention_tensors, dtype, codec=None, group_size=None, threshold=None,
+                  layout='LBHNN', allocated=False):
+    """
+    Write the attention layers at the current position of `f`, encoded as
+    `dtype`. Raw layers are mapped in only if the file is `allocated`.
+    """
+    if dtype == 'uint8_affine':
+        _write_int8_layers(f, attention_tensors)
+    elif dtype == 'int4_affine':
+        _write_int4_layers(f, attention_tensors, group_size)
+    elif dtype == 'sparse_fp16':
+        _write_sparse_layers(f, attention_tensors, threshold)
+    elif codec:
+        _write_compressed_layers(f, attention_tensors, dtype, layout)
+    elif not allocated:
+        _write_raw_layers(f, attention_tensors, dtype, layout)
+    else:
+        try:
+            _map_raw_layers(f, attention_tensors, dtype, layout)
+        except (OSError, ValueError):
+            # No shared mappings here (e.g. some network filesystems): stream tiles
+            _write_raw_layers(f, attention_tensors, dtype, layout)
+
 
-    # Compute sizes for verification
+def _write_chunked_attnbin(filepath, meta, input_bounds, attention_tensors, dtype,
+                           chunk_size, codec=None, layout='LBHNN'):
+    """
+    Write all batches to one file as chunks of `chunk_size`: a single
+    header, then per chunk its bounds and layers, laid out exactly like the
+    body of a standalone file of just those batches. The header's `chunks`
+    table holds each chunk's [byte_offset, byte_length]; those are only
+    known once the chunks are written, so room for the table is reserved
+    up front as NUL padding (which readers strip) and filled in last.
+    Returns (header_bytes, chunk table).
+    """
+    B = meta['B']
+    starts = range(0, B, chunk_size)
+    meta = dict(meta, chunk_size=chunk_size, chunks=[])
+    reserved = len(_pack_header(meta)) + len(starts) * _CHUNK_ENTRY_BYTES
+    size = None
+    if not codec:
+        dims = (len(attention_tensors), B, meta['H'], meta['N'])
+        size = 4 + reserved + input_bounds.nbytes + dims[0] * _payload_sizes(dims, dtype)[1]
+    table = []
+    with open(filepath, 'w+b', buffering=_WRITE_BUFFER) as f:
+        allocated = _prepare_output(f, size)
+        f.write(reserved.to_bytes(4, 'little'))
+        f.write(bytes(reserved))
+        for start in starts:
+            end = min(start + chunk_size, B)
+            offset = f.tell()
+            input_bounds[start:end].tofile(f)
+            _write_layers(f, [t[start:end] for t in attention_tensors], dtype, codec,
+                          layout=layout, allocated=allocated)
+            table.append([offset, f.tell() - offset])
+        meta['chunks'] = table
+        f.seek(4)
+        f.write(_pack_header(meta))
+    return 4 + reserved, table
+
+
+_LABELS = {'float32': '', 'float16': ' (fp16)', 'uint8_affine': ' (int8)', 'int4_affine': ' (int4)',
+           'sparse_fp16': ' (sparse fp16)'}
+
+
+def _check_layout(layout, dtype):
+    if layout not in _LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r}, expected one of {_LAYOUTS}")
+    if layout != 'LBHNN' and dtype not in ('float32', 'float16'):
+        raise ValueError(f"layout={layout!r} is only supported for fp32/fp16 exports")
+
+
+def _summary(dims, dtype, header, group_size=None, verbose=True):
+    """
+    Expected uncompressed file size, printed as a summary if `verbose`.
+    Sparse sizes depend on the data, so sparse_fp16 reports the dense fp16 size.
+    """
+    L, B, H, N = dims
     bounds_bytes = B * N * 4
-    layer_bytes = B * H * N * N * 4
-    total_data = bounds_bytes + L * layer_bytes
-    total_file = 4 + len(header) + total_data
-
-    print(f"Export summary:")
-    print(f"  Reactions:  {N}")
-    print(f"  Batches:    {B}")
-    print(f"  Heads:      {H}")
-    print(f"  Layers:     {L}")
-    print(f"  Header:     {len(header):,} bytes")
-    print(f"  Bounds:     {bounds_bytes:,} bytes")
-    print(f"  Per layer:  {layer_bytes:,} bytes")
-    print(f"  Total file: {total_file:,} bytes ({total_file / 1e6:.1f} MB)")
-
-    with open(filepath, 'wb') as f:
-        # Header length (uint32 little-endian)
-        f.write(struct.pack('<I', len(header)))
-        # JSON header
-        f.write(header)
-        # Input bounds
-        f.write(input_bounds.tobytes())
-        # Attention layers
-        for i, t in enumerate(attention_tensors):
-            f.write(np.asarray(t, dtype=np.float32).tobytes())
-
-    print(f"  Written to: {filepath}")
+    sparse = dtype == 'sparse_fp16'
+    table_bytes, layer_bytes = _payload_sizes(dims, 'float16' if sparse else dtype, group_size)
+    total_file = 4 + len(header) + bounds_bytes + table_bytes + L * layer_bytes
+    if verbose:
+        print(f"Export summary{_LABELS[dtype]}:")
+        print(f"  Reactions:  {N}")
+        print(f"  Batches:    {B}")
+        print(f"  Heads:      {H}")
+        print(f"  Layers:     {L}")
+        print(f"  Header:     {len(header):,} bytes")
+        print(f"  Bounds:     {bounds_bytes:,} bytes")
+        if sparse:
+            print(f"  Dense fp16: {total_file:,} bytes ({total_file / 1e6:.1f} MB)")
+        else:
+            print(f"  Per layer:  {layer_bytes:,} bytes")
+            print(f"  Total file: {total_file:,} bytes ({total_file / 1e6:.1f} MB)")
+    return total_file
+
+
+def _export(filepath, reaction_ids, reaction_names_dict, attention_tensors, input_bounds,
+            dtype, codec=None, group_size=None, threshold=None, layout='LBHNN',
+            msgpack_header=False, full_names=None, verbose=True):
+    """Validate, build the header and write one file; shared by the exporters."""
+    if codec not in _CODECS:
+        raise ValueError(f"Unknown codec {codec!r}, expected one of {_CODECS}")
+    _check_layout(layout, dtype)
+    if group_size is not None and group_size < 1:
+        raise ValueError(f"group_size must be at least 1, got {group_size}")
+    dims, input_bounds = _validate(reaction_ids, attention_tensors, input_bounds)
+    if group_size:
+        group_size = min(group_size, dims[3])
+    if full_names is None:
+        full_names = _full_names(reaction_ids, reaction_names_dict)
+    header = _pack_header(_header_meta(dims, reaction_ids, full_names, dtype, codec, group_size,
+                                       threshold, layout),
+                          msgpack_header)
+
+    total_file = _summary(dims, dtype, header, group_size, verbose)
+    size = _write_attnbin(filepath, header, input_bounds, attention_tensors, dtype,
+                          codec, group_size, threshold, layout)
+
+    if verbose:
+        if threshold is not None:
+            print(f"  Sparse:     {size:,} bytes ({size / total_file:.0%} of dense fp16)")
+        elif codec:
+            print(f"  Compressed: {size:,} bytes ({size / total_file:.0%} of raw)")
+        print(f"  Written to: {filepath}")
+    return size
+
+
+def export_attention_data(filepath, reaction_ids, reaction_names_dict,
+                          attention_tensors, input_bounds, codec=None, layout='LBHNN',
+                          msgpack_header=False, full_names=None, verbose=True):
+    """
+    Export attention data to a compact binary file for the web visualizer.
+
+    Parameters
+    ----------
+    filepath : str
+        Output path (recommended extension: .attnbin).
+    reaction_ids : list of str, length N
+        Short reaction identifiers (embedding labels).
+    reaction_names_dict : dict
+        Mapping from short ID to full human-readable name.
+    attention_tensors : list of L numpy arrays
+        Each array has shape (B, H, N, N) — float32 or float64.
+    input_bounds : array-like, shape (B, N)
+        Per-sample per-reaction bound values.
+    codec : None or 'zlib'
+        'zlib' stores each (layer, batch, head) slice byte-shuffled and
+        deflated; sparse, peaked attention maps shrink the most. The web
+        visualizer inflates the layers on load.
+    layout : 'LBHNN' or 'BHLNN'
+        Order of the (layer, batch, head) slices. 'BHLNN' stores the L
+        layers of each (batch, head) next to each other, so everything the
+        viewer shows for one selection is a single contiguous range.
+    msgpack_header : bool
+        Encode the header with msgpack instead of JSON (smaller and faster
+        to parse for large N; needs the optional msgpack package). The web
+        visualizer detects either encoding.
+    full_names : list of str or None
+        Precomputed full names (one per ID). None = look them up in
+        reaction_names_dict. Lets repeated exports share one lookup.
+    verbose : bool
+        Print the export summary.
+    """
+    _export(filepath, reaction_ids, reaction_names_dict, attention_tensors, input_bounds,
+            'float32', codec=codec, layout=layout, msgpack_header=msgpack_header,
+            full_names=full_names, verbose=verbose)
 
 
 # ---- Convenience: export with fp16 for ~50% smaller files ----
 
 def export_attention_data_fp16(filepath, reaction_ids, reaction_names_dict,
-                               attention_tensors, input_bounds):
+                               attention_tensors, input_bounds, codec=None, layout='LBHNN',
+                               msgpack_header=False, full_names=None, verbose=True):
     """
     Same as export_attention_data but stores attention weights as float16.
     ~50% smaller files at the cost of ~0.001 precision loss.
     The web visualizer auto-detects fp16 from the header.
     """
-    L = len(attention_tensors)
-    B, H, N, _ = attention_tensors[0].shape
-    assert len(reaction_ids) == N
+    _export(filepath, reaction_ids, reaction_names_dict, attention_tensors, input_bounds,
+            'float16', codec=codec, layout=layout, msgpack_header=msgpack_header,
+            full_names=full_names, verbose=verbose)
 
-    input_bounds = np.asarray(input_bounds, dtype=np.float32)
-    assert input_bounds.shape == (B, N)
 
-    full_names = [reaction_names_dict.get(rid, rid) for rid in reaction_ids]
+# ---- Convenience: export with 8-bit quantization for ~75% smaller files ----
+
+def export_attention_data_int8(filepath, reaction_ids, reaction_names_dict,
+                               attention_tensors, input_bounds, msgpack_header=False,
+                               full_names=None, verbose=True):
+    """
+    Same as export_attention_data but stores attention weights as uint8,
+    scaled affinely to each (layer, batch, head) slice's [min, max].
+    ~75% smaller files; the error is at most half a step, (max - min) / 510.
+    The web visualizer auto-detects int8 from the header.
+
+    Layout after the input bounds:
+        [L*B*H*4]   per-slice scale  (float32)
+        [L*B*H*4]   per-slice offset (float32)
+        [B*H*N*N]   layer_0 attention (uint8), value = offset + q * scale
+        ...
+    """
+    _export(filepath, reaction_ids, reaction_names_dict, attention_tensors, input_bounds,
+            'uint8_affine', msgpack_header=msgpack_header,
+            full_names=full_names, verbose=verbose)
 
-    header = json.dumps({
-        'format': 'attnbin_v1',
-        'N': int(N),
-        'B': int(B),
-        'H': int(H),
-        'L': int(L),
-        'dtype': 'float16',
-        'reaction_ids': list(reaction_ids),
-        'full_names': full_names,
-    }, separators=(',', ':')).encode('utf-8')
 
-    bounds_bytes = B * N * 4  # bounds always float32
-    layer_bytes = B * H * N * N * 2  # fp16
-    total_file = 4 + len(header) + bounds_bytes + L * layer_bytes
+# ---- Archival: 4-bit grouped quantization for ~87% smaller files ----
 
-    print(f"Export summary (fp16):")
-    print(f"  Reactions:  {N}")
-    print(f"  Batches:    {B}")
-    print(f"  Heads:      {H}")
-    print(f"  Layers:     {L}")
-    print(f"  Total file: {total_file:,} bytes ({total_file / 1e6:.1f} MB)")
+def export_attention_data_int4(filepath, reaction_ids, reaction_names_dict,
+                               attention_tensors, input_bounds, group_size=64,
+                               msgpack_header=False, full_names=None, verbose=True):
+    """
+    Same as export_attention_data but stores attention weights as 4-bit
+    codes. Each attention row is split into groups of `group_size` columns
+    (the last group may be shorter), each with its own fp16 scale and bias.
+    ~1/8 the fp32 size plus 0.5 bytes of scale/bias per group.
+    The web visualizer auto-detects int4 from the header.
+
+    Layout after the input bounds, with G = ceil(N / group_size) groups per row:
+        [L*B*H*N*G*2]         per-group scale (float16)
+        [L*B*H*N*G*2]         per-group bias  (float16)
+        [B*H*ceil(N*N/2)]     layer_0 codes, two per byte (low nibble first),
+        ...                   value = bias + q * scale
+    """
+    _export(filepath, reaction_ids, reaction_names_dict, attention_tensors, input_bounds,
+            'int4_affine', group_size=group_size, msgpack_header=msgpack_header,
+            full_names=full_names, verbose=verbose)
 
-    with open(filepath, 'wb') as f:
-        f.write(struct.pack('<I', len(header)))
-        f.write(header)
-        f.write(input_bounds.tobytes())
-        for t in attention_tensors:
-            f.write(np.asarray(t, dtype=np.float16).tobytes())
 
-    print(f"  Written to: {filepath}")
+# ---- Sparse: keep only entries above a threshold ----
+
+def export_attention_data_sparse(filepath, reaction_ids, reaction_names_dict,
+                                 attention_tensors, input_bounds, threshold=1e-3,
+                                 msgpack_header=False, full_names=None, verbose=True):
+    """
+    Same as export_attention_data but stores only the entries with
+    |value| > `threshold`, as fp16, plus a bitmap per row of which entries
+    were kept; the rest read back as 0. Softmax attention is mostly near
+    zero, so files are typically several times smaller than fp16.
+    The web visualizer auto-detects sparse fp16 from the header.
+
+    Layout after the input bounds:
+        [L*B*H*4]   kept values per slice (uint32), layer-major
+        [...]       per (layer, batch, head) slice:
+                    [N*ceil(N/8)]  row bitmaps (np.packbits, first column in the high bit)
+                    [count*2]      kept values (float16), row-major
+    """
+    _export(filepath, reaction_ids, reaction_names_dict, attention_tensors, input_bounds,
+            'sparse_fp16', threshold=threshold, msgpack_header=msgpack_header,
+            full_names=full_names, verbose=verbose)
 
 
 def export_attention_subset(filepath, reaction_ids, reaction_names_dict,
                            attention_tensors, input_bounds,
-                           batch_indices=None, fp16=False):
+                           batch_indices=None, fp16=False, codec=None, layout='LBHNN',
+                           full_names=None, verbose=True):
     """
     Export a subset of batches. Useful for large datasets.
 
     Parameters
     ----------
-    batch_indices : list of int or None
-        Which batch indices to include. None = all batches.
+    batch_indices : list of int, range, slice or None
+        Which batch indices to include. None = all batches. Evenly spaced
+        indices are taken as views instead of copies.
     fp16 : bool
         If True, store attention weights as float16 (~50% smaller).
+    codec : None or 'zlib'
+        Per-slice compression, see export_attention_data.
+    layout : 'LBHNN' or 'BHLNN'
+        Slice order, see export_attention_data.
+    full_names : list of str or None
+        Precomputed full names, see export_attention_data.
 
     Example — export every 10th sample:
         export_attention_subset('sampled.attnbin', ids, names, tensors, bounds,
-                                batch_indices=list(range(0, 1000, 10)))
+                                batch_indices=range(0, 1000, 10))
     """
     if batch_indices is not None:
-        batch_indices = list(batch_indices)
-        input_bounds = np.asarray(input_bounds)[batch_indices]
-        attention_tensors = [t[batch_indices] for t in attention_tensors]
+        sel = _batch_selector(batch_indices, len(attention_tensors[0]))
+        input_bounds = np.asarray(input_bounds)[sel]
+        attention_tensors = [t[sel] for t in attention_tensors]
 
-    if fp16:
-        export_attention_data_fp16(filepath, reaction_ids, reaction_names_dict,
-                                   attention_tensors, input_bounds)
-    else:
-        export_attention_data(filepath, reaction_ids, reaction_names_dict,
-                              attention_tensors, input_bounds)
+    _export(filepath, reaction_ids, reaction_names_dict, attention_tensors, input_bounds,
+            'float16' if fp16 else 'float32', codec=codec, layout=layout,
+            full_names=full_names, verbose=verbose)
 
 
 def export_attention_chunked(output_dir, reaction_ids, reaction_names_dict,
                              attention_tensors, input_bounds,
-                             chunk_size=50, fp16=True):
+                             chunk_size=50, fp16=True, codec=None, layout='LBHNN',
+                             single_file=True, verbose=False):
     """
-    Export large datasets as multiple chunk files for manageable web loading.
+    Export large datasets in chunks of batches for manageable web loading.
+
+    Creates files:  chunks.attnbin + index.json
+    One file holding all chunks after a single shared header, whose
+    `chunks` table (mirrored in index.json with batch ranges) gives each
+    chunk's byte offset and length. The web visualizer reads just the
+    header and the selected chunk, via File.slice or HTTP Range requests
+    (open index.html?src=<output_dir>/index.json).
 
-    Creates files:  chunk_0.attnbin, chunk_1.attnbin, ...
-    Each contains `chunk_size` batches.
+    With single_file=False:  chunk_0.attnbin, chunk_1.attnbin, ...
+    Each a standalone file of `chunk_size` batches.
 
     Parameters
     ----------
     output_dir : str
         Directory to write chunk files.
     chunk_size : int
-        Number of batches per chunk file.
+        Number of batches per chunk.
     fp16 : bool
         Use float16 for ~50% smaller files.
+    codec : None or 'zlib'
+        Per-slice compression, see export_attention_data.
+    layout : 'LBHNN' or 'BHLNN'
+        Slice order within each chunk, see export_attention_data.
+    single_file : bool
+        Write one indexed file instead of one file per chunk.
+    verbose : bool
+        Also print a full summary (per chunk with single_file=False).
 
     Example for 1000 samples:
         export_attention_chunked('chunks/', ids, names, tensors, bounds,
                                  chunk_size=50, fp16=True)
-        # Creates 20 files of ~192 MB each (for N=200, H=8, L=6)
+        # Creates one ~3.8 GB file of 20 chunks (for N=200, H=8, L=6)
     """
-    import os
+    if codec not in _CODECS:
+        raise ValueError(f"Unknown codec {codec!r}, expected one of {_CODECS}")
+    dtype = 'float16' if fp16 else 'float32'
+    _check_layout(layout, dtype)
     os.makedirs(output_dir, exist_ok=True)
 
-    B = attention_tensors[0].shape[0]
+    # Validation and the header are shared by all chunks; only B differs
+    dims, input_bounds = _validate(reaction_ids, attention_tensors, input_bounds)
+    L, B, H, N = dims
+    meta = _header_meta(dims, reaction_ids, _full_names(reaction_ids, reaction_names_dict),
+                        dtype, codec, layout=layout)
+
+    if single_file:
+        fname = os.path.join(output_dir, 'chunks.attnbin')
+        if verbose:
+            _summary(dims, dtype, _pack_header(meta))
+        header_bytes, table = _write_chunked_attnbin(fname, meta, input_bounds,
+                                                     attention_tensors, dtype, chunk_size, codec,
+                                                     layout)
+        index = {
+            'file': os.path.basename(fname),
+            'header_bytes': header_bytes,
+            'chunk_size': chunk_size,
+            'chunks': [{'chunk_idx': i,
+                        'batch_range': [start, min(start + chunk_size, B)],
+                        'byte_offset': offset,
+                        'byte_length': length}
+                       for i, (start, (offset, length)) in enumerate(zip(range(0, B, chunk_size), table))],
+        }
+        index_path = os.path.join(output_dir, 'index.json')
+        with open(index_path, 'w') as f:
+            json.dump(index, f, indent=1)
+        for c in index['chunks']:
+            start, end = c['batch_range']
+            print(f"Chunk {c['chunk_idx']}: batches [{start}, {end}) -> "
+                  f"{c['byte_length']:,} bytes at {c['byte_offset']:,}")
+        print(f"\n=== Exported {len(table)} chunks to {fname} (index: {index_path}) ===")
+        print(f"Pick a chunk from the top bar of the web visualizer.")
+        return
+
     chunk_idx = 0
     for start in range(0, B, chunk_size):
         end = min(start + chunk_size, B)
-        indices = list(range(start, end))
         fname = os.path.join(output_dir, f'chunk_{chunk_idx}.attnbin')
-        print(f"\n--- Chunk {chunk_idx}: batches [{start}, {end}) ---")
-        export_attention_subset(fname, reaction_ids, reaction_names_dict,
-                                attention_tensors, input_bounds,
-                                batch_indices=indices, fp16=fp16)
+        meta['B'] = end - start
+        header = _pack_header(meta)
+        if verbose:
+            print(f"\n--- Chunk {chunk_idx}: batches [{start}, {end}) ---")
+            _summary((L, end - start, H, N), dtype, header)
+        size = _write_attnbin(fname, header, input_bounds[start:end],
+                              [t[start:end] for t in attention_tensors], dtype, codec,
+                              layout=layout)
+        if verbose:
+            print(f"  Written to: {fname}")
+        else:
+            print(f"Chunk {chunk_idx}: batches [{start}, {end}) -> {fname} ({size:,} bytes)")
         chunk_idx += 1
 
     print(f"\n=== Exported {chunk_idx} chunks to {output_dir} ===")
     print(f"Load individual chunks in the web visualizer as needed.")
 
 
+# ---- Streaming: write batches as they are produced ----
+
+def export_attention_streaming(filepath, reaction_ids, reaction_names_dict, batch_iterator,
+                               L, H, N, fp16=True, chunk_size=50, verbose=True):
+    """
+    Export batches one at a time as an iterator produces them (e.g. from a
+    model's inference loop), holding a single batch in memory.
+
+    `batch_iterator` yields (bounds_row, layers) per batch: bounds_row of
+    shape (N,) and layers a list of L arrays of shape (H, N, N).
+
+    The file is a single chunked file as written by export_attention_chunked,
+    except that the chunk table is implicit: every batch takes `batch_bytes`
+    (a header field), so chunk i starts i * chunk_size * batch_bytes after
+    the header. B is only known once the iterator is exhausted, so it is
+    written last into room reserved in the header. Each batch goes straight
+    to its place in its chunk; if the data ends partway through a chunk,
+    that chunk's layers are moved up to close the gap.
+    Returns the number of batches written.
+    """
+    assert len(reaction_ids) == N, \
+        f"reaction_ids length {len(reaction_ids)} != context size {N}"
+    # Check the arguments and for data before creating the file, so nothing is left behind
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+    batch_iterator = iter(batch_iterator)
+    first = next(batch_iterator, None)
+    if first is None:
+        raise ValueError("batch_iterator yielded no batches")
+    dtype = 'float16' if fp16 else 'float32'
+    slice_bytes = H * N * N * np.dtype(dtype).itemsize
+    bounds_bytes = N * 4
+    meta = _header_meta((L, 0, H, N), reaction_ids,
+                        _full_names(reaction_ids, reaction_names_dict), dtype)
+    meta.update(chunk_size=chunk_size, batch_bytes=bounds_bytes + L * slice_bytes)
+    # Room for any B; the unused part is NUL padding
+    reserved = len(_pack_header(dict(meta, B=2 ** 53)))
+    data_start = 4 + reserved
+    chunk_bytes = chunk_size * meta['batch_bytes']
+
+    layers_buf = np.empty((L, H, N, N), dtype=dtype)
+    B = 0
+    # Unbuffered: every slice goes to its own offset, so a write buffer would
+    # only be flushed by the next seek (and there is no sequential access to hint)
+    with open(filepath, 'w+b', buffering=0) as f:
+        f.write(reserved.to_bytes(4, 'little'))
+        f.write(bytes(reserved))
+        for bounds_row, layers in itertools.chain([first], batch_iterator):
+            bounds_row = np.asarray(bounds_row, dtype=np.float32)
+            assert bounds_row.shape == (N,), \
+                f"Batch {B} bounds shape {bounds_row.shape} != ({N},)"
+            assert len(layers) == L, f"Batch {B} has {len(layers)} layers, expected {L}"
+            for l, t in enumerate(layers):
+                assert t.shape == (H, N, N), \
+                    f"Batch {B} layer {l} shape {t.shape} != ({H}, {N}, {N})"
+                _copy_layer(layers_buf[l], t)
+            chunk, k = divmod(B, chunk_size)
+            base = data_start + chunk * chunk_bytes
+            f.seek(base + k * bounds_bytes)
+            bounds_row.tofile(f)
+            for l in range(L):
+                f.seek(base + chunk_size * bounds_bytes + (l * chunk_size + k) * slice_bytes)
+                layers_buf[l].tofile(f)
+            B += 1
+
+        # Close the gaps of a partial last chunk: its layers move up to
+        # follow `last` batches' bounds instead of a full chunk's
+        chunk, last = divmod(B, chunk_size)
+        if last:
+            base = data_start + chunk * chunk_bytes
+            for l in range(L):
+                f.seek(base + chunk_size * bounds_bytes + l * chunk_size * slice_bytes)
+                data = f.read(last * slice_bytes)
+                f.seek(base + last * bounds_bytes + l * last * slice_bytes)
+                f.write(data)
+        f.truncate(data_start + B * meta['batch_bytes'])
+
+        meta['B'] = B
+        f.seek(4)
+        f.write(_pack_header(meta))
+        size = f.seek(0, os.SEEK_END)
+
+    if verbose:
+        print(f"Streamed {B} batches{_LABELS[dtype]} in {-(-B // chunk_size)} chunks "
+              f"of {chunk_size}")
+        print(f"  Total file: {size:,} bytes ({size / 1e6:.1f} MB)")
+        print(f"  Written to: {filepath}")
+    return B
+
+
 # ---- Size estimation utility ----
 
-def estimate_file_size(N, B, H, L, fp16=False):
-    """Print estimated file sizes for planning."""
-    bpf = 2 if fp16 else 4
+@lru_cache(maxsize=64)
+def _estimate(N, B, H, L, fp16):
+    """(bounds, layers, total) bytes of an uncompressed fp32/fp16 file."""
     header_est = 500 + N * 20  # rough estimate
     bounds = B * N * 4
-    layers = L * B * H * N * N * bpf
-    total = 4 + header_est + bounds + layers
+    layers = L * _payload_sizes((L, B, H, N), 'float16' if fp16 else 'float32')[1]
+    return bounds, layers, 4 + header_est + bounds + layers
+
+
+def estimate_file_size(N, B, H, L, fp16=False, verbose=True):
+    """
+    Estimate file sizes for planning. Returns a dict of 'bounds', 'layers'
+    and 'total' bytes; with `verbose`, also prints them.
+    """
+    bounds, layers, total = _estimate(N, B, H, L, fp16)
+    if not verbose:
+        return {'bounds': bounds, 'layers': layers, 'total': total}
     dtype = 'fp16' if fp16 else 'fp32'
     print(f"Estimate ({dtype}): N={N}, B={B}, H={H}, L={L}")
     print(f"  Bounds:     {bounds/1e6:>8.1f} MB")
     print(f"  Layers:     {layers/1e6:>8.1f} MB")
     print(f"  Total:      {total/1e6:>8.1f} MB  ({total/1e9:.2f} GB)")
     print(f"  Per-batch:  {(bounds/B + layers/B)/1e6:.1f} MB")
-    return total
+    return {'bounds': bounds, 'layers': layers, 'total': total}
 
 
 if __name__ == '__main__':
@@ -258,5 +983,12 @@ if __name__ == '__main__':
 
     export_attention_data('test_fp32.attnbin', ids, names, tensors, bounds)
     export_attention_data_fp16('test_fp16.attnbin', ids, names, tensors, bounds)
+    export_attention_data_int8('test_int8.attnbin', ids, names, tensors, bounds)
+    export_attention_data_int4('test_int4.attnbin', ids, names, tensors, bounds)
+    export_attention_data_sparse('test_sparse.attnbin', ids, names, tensors, bounds)
     export_attention_subset('test_subset.attnbin', ids, names, tensors, bounds,
                             batch_indices=[0, 5, 10, 15], fp16=True)
+    export_attention_data('test_zlib.attnbin', ids, names, tensors, bounds, codec='zlib')
+    export_attention_streaming('test_stream.attnbin', ids, names,
+                               ((bounds[b], [t[b] for t in tensors]) for b in range(B)),
+                               L, H, N, chunk_size=8)